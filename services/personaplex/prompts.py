@@ -2,6 +2,13 @@
 Prompt templates for PersonaPlex claim assistant.
 """
 
+import sys
+from functools import lru_cache
+
+# Placeholder for claim fields that are missing or empty
+_UNKNOWN = sys.intern("Unknown")
+
+# Reference copy of the claim template; _build_prompt renders the same text
 CLAIM_ASSISTANT_PROMPT = """You are a helpful assistant for healthcare billing specialists. You have access to the following claim information:
 
 Claim Number: {claim_number}
@@ -28,32 +35,95 @@ def format_claim_prompt(claim_context: dict) -> str:
     Returns:
         Formatted prompt string for PersonaPlex
     """
+    # Reduce the mutable context to a hashable key so repeat claims hit the cache
+    g = claim_context.get
+    fields = (
+        g("claimNumber") or _UNKNOWN,
+        g("patientName") or _UNKNOWN,
+        g("patientMrn") or _UNKNOWN,
+        g("payerName") or _UNKNOWN,
+        g("memberId") or _UNKNOWN,
+        g("dateOfService") or _UNKNOWN,
+        g("totalCharges") or 0,
+        g("status") or _UNKNOWN,
+        tuple(g("diagnoses") or ()),
+        tuple(g("procedures") or ()),
+    )
+    try:
+        hash(fields)
+    except TypeError:
+        # Unhashable field values (e.g. nested objects) bypass the cache
+        return _format_claim_prompt_cached.__wrapped__(*fields)
+    return _format_claim_prompt_cached(*fields)
+
+
+# typed=True keeps 1, 1.0 and True from sharing a rendered prompt
+@lru_cache(maxsize=1024, typed=True)
+def _format_claim_prompt_cached(
+    claim_number,
+    patient_name,
+    patient_mrn,
+    payer_name,
+    member_id,
+    date_of_service,
+    total_charges,
+    status,
+    diagnoses: tuple,
+    procedures: tuple,
+) -> str:
+    """Fill the claim template; cached on the canonical claim field tuple."""
     # Format diagnoses as a readable list
-    diagnoses = claim_context.get("diagnoses", [])
     diagnoses_str = ", ".join(diagnoses) if diagnoses else "None provided"
     
     # Format procedures as a readable list
-    procedures = claim_context.get("procedures", [])
     procedures_str = ", ".join(procedures) if procedures else "None provided"
     
     # Format total charges
-    total_charges = claim_context.get("totalCharges", 0)
     if isinstance(total_charges, (int, float)):
         total_charges = f"{total_charges:,.2f}"
     
-    return CLAIM_ASSISTANT_PROMPT.format(
-        claim_number=claim_context.get("claimNumber", "Unknown"),
-        patient_name=claim_context.get("patientName", "Unknown"),
-        patient_mrn=claim_context.get("patientMrn", "Unknown"),
-        payer_name=claim_context.get("payerName", "Unknown"),
-        member_id=claim_context.get("memberId", "Unknown"),
-        date_of_service=claim_context.get("dateOfService", "Unknown"),
-        total_charges=total_charges,
-        status=claim_context.get("status", "Unknown"),
-        diagnoses=diagnoses_str,
-        procedures=procedures_str,
+    return _build_prompt(
+        claim_number,
+        patient_name,
+        patient_mrn,
+        payer_name,
+        member_id,
+        date_of_service,
+        total_charges,
+        status,
+        diagnoses_str,
+        procedures_str,
     )
 
 
+def _build_prompt(
+    claim_number,
+    patient_name,
+    patient_mrn,
+    payer_name,
+    member_id,
+    date_of_service,
+    total_charges,
+    status,
+    diagnoses,
+    procedures,
+) -> str:
+    """Render CLAIM_ASSISTANT_PROMPT as an f-string, skipping str.format parsing."""
+    return f"""You are a helpful assistant for healthcare billing specialists. You have access to the following claim information:
+
+Claim Number: {claim_number}
+Patient Name: {patient_name}
+Patient MRN: {patient_mrn}
+Insurance Payer: {payer_name}
+Member ID: {member_id}
+Date of Service: {date_of_service}
+Total Charges: ${total_charges}
+Claim Status: {status}
+Diagnosis Codes: {diagnoses}
+Procedure Codes: {procedures}
+
+Answer questions about this claim clearly and concisely. If asked for information not in the claim data, say you don't have that information. Be conversational and helpful."""
+
+
 # Default prompt when no claim context is provided
 DEFAULT_ASSISTANT_PROMPT = """You are a helpful assistant for healthcare billing specialists. You can help answer questions about claims, billing codes, and insurance processes. Ask the user what claim they'd like to discuss."""
@@ -8,23 +8,29 @@ This server wraps the PersonaPlex model and provides:
 """
 
 import asyncio
+import hashlib
+import heapq
 import json
 import logging
 import os
-import secrets
-import subprocess
-import sys
+import re
+import time
+from base64 import urlsafe_b64encode
+from collections import OrderedDict, deque
 from contextlib import asynccontextmanager
 from dataclasses import dataclass, field
 from datetime import datetime, timedelta
+from os import urandom
 from typing import Optional
 from urllib.parse import urlencode
 
-import uvicorn
+import orjson
+import websockets
 from dotenv import load_dotenv
-from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, HTTPException, Request, WebSocket
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.websockets import WebSocketState
+from pydantic import BaseModel, ConfigDict
 
 from prompts import DEFAULT_ASSISTANT_PROMPT, format_claim_prompt
 
@@ -44,37 +50,116 @@ CONTEXT_API_PORT = int(os.getenv("CONTEXT_API_PORT", "8999"))
 ALLOWED_ORIGINS = os.getenv("ALLOWED_ORIGINS", "http://localhost:3000").split(",")
 SESSION_TTL_MINUTES = int(os.getenv("SESSION_TTL_MINUTES", "60"))
 VOICE_PROMPT = os.getenv("VOICE_PROMPT", "NATF2.pt")  # Natural female voice
+PERSONAPLEX_STARTUP_TIMEOUT = int(os.getenv("PERSONAPLEX_STARTUP_TIMEOUT", "300"))
+# Both limits need room for at least one session
+MAX_SESSIONS = max(1, int(os.getenv("MAX_SESSIONS", "1000")))
+MAX_SESSIONS_PER_CLIENT = max(1, int(os.getenv("MAX_SESSIONS_PER_CLIENT", "5")))
 
+_TTL_SECONDS = SESSION_TTL_MINUTES * 60
 
-@dataclass
+# URLs are fixed per process, so build them once
+# The client connects through this wrapper's WebSocket proxy
+_WS_BASE_URL = f"ws://{os.getenv('PUBLIC_HOST', 'localhost')}:{CONTEXT_API_PORT}"
+# PersonaPlex WebSocket endpoint is at /api/chat with voice_prompt and text_prompt query params
+_PP_BASE_URL = f"ws://{os.getenv('PERSONAPLEX_HOST', 'localhost')}:{PERSONAPLEX_PORT}/api/chat"
+# Upstream close codes that are reported locally but may not be sent in a
+# close frame. 1005 (no status) is a normal close; the rest mean the upstream
+# failed and are passed on as 1011 so the client treats them as an error.
+_ABNORMAL_CLOSE_CODES = frozenset({1006, 1015})
+
+
+def _new_sid() -> str:
+    """Generate a URL-safe session ID with 192 bits of entropy."""
+    return urlsafe_b64encode(urandom(24)).decode("ascii")
+
+
+def _context_key(claim_context: Optional[dict], client_id: str) -> bytes:
+    """Digest identifying one client's request for a given claim context."""
+    try:
+        payload = orjson.dumps(claim_context, option=orjson.OPT_SORT_KEYS)
+    except orjson.JSONEncodeError:
+        # orjson rejects integers beyond 64 bits; the stdlib encoder doesn't
+        payload = json.dumps(claim_context, sort_keys=True).encode()
+    digest = hashlib.blake2b(client_id.encode(), digest_size=16)
+    digest.update(b"\0")
+    digest.update(payload)
+    return digest.digest()
+
+
+@dataclass(slots=True)
 class Session:
     """Represents an active voice session with claim context."""
     session_id: str
     claim_context: Optional[dict] = None
     text_prompt: str = DEFAULT_ASSISTANT_PROMPT
+    client_id: Optional[str] = None
+    context_key: Optional[bytes] = field(default=None, repr=False)
     created_at: datetime = field(default_factory=datetime.utcnow)
-    last_accessed: datetime = field(default_factory=datetime.utcnow)
+    # Monotonic clock readings; datetimes are only derived for the info endpoint
+    _created_mono: float = field(init=False, repr=False)
+    _expires_at: float = field(init=False, repr=False)
+    # Upstream URL carrying this session's prompt, built on first connect
+    _personaplex_url: Optional[str] = field(default=None, init=False, repr=False)
+    
+    def __post_init__(self) -> None:
+        self._created_mono = time.monotonic()
+        self._expires_at = self._created_mono + _TTL_SECONDS
+    
+    @property
+    def personaplex_url(self) -> str:
+        """PersonaPlex WebSocket URL with this session's voice and text prompts."""
+        if self._personaplex_url is None:
+            query_params = urlencode({
+                "voice_prompt": VOICE_PROMPT,
+                "text_prompt": self.text_prompt,
+            })
+            self._personaplex_url = f"{_PP_BASE_URL}?{query_params}"
+        return self._personaplex_url
+    
+    @property
+    def last_accessed(self) -> datetime:
+        """Wall-clock time of the last access, derived from the expiry deadline."""
+        elapsed = self._expires_at - _TTL_SECONDS - self._created_mono
+        return self.created_at + timedelta(seconds=elapsed)
     
     def is_expired(self) -> bool:
         """Check if the session has expired."""
-        expiry = self.last_accessed + timedelta(minutes=SESSION_TTL_MINUTES)
-        return datetime.utcnow() > expiry
+        return time.monotonic() > self._expires_at
     
     def touch(self) -> None:
-        """Update last accessed time."""
-        self.last_accessed = datetime.utcnow()
+        """Push the expiry deadline out by the session TTL."""
+        self._expires_at = time.monotonic() + _TTL_SECONDS
 
 
 class SessionManager:
     """Manages voice sessions with claim contexts."""
     
-    def __init__(self):
-        self._sessions: dict[str, Session] = {}
+    def __init__(self, max_sessions: int = MAX_SESSIONS):
+        # Ordered least recently used first, so the oldest can be evicted
+        self._sessions: OrderedDict[str, Session] = OrderedDict()
+        self._max_sessions = max_sessions
+        self._client_counts: dict[str, int] = {}
+        # Context digest -> session_id, so repeated requests reuse a session
+        self._by_context: dict[bytes, str] = {}
+        self.evictions = 0
+        # (deadline, session_id) min-heap; entries are re-checked lazily on pop
+        self._expiry_heap: list[tuple[float, str]] = []
         self._cleanup_task: Optional[asyncio.Task] = None
     
-    def create_session(self, claim_context: Optional[dict] = None) -> str:
-        """Create a new session with optional claim context."""
-        session_id = secrets.token_urlsafe(32)
+    def create_session(
+        self,
+        claim_context: Optional[dict] = None,
+        client_id: Optional[str] = None,
+        context_key: Optional[bytes] = None,
+    ) -> Session:
+        """Create a new session, evicting the least recently used one when full."""
+        while self._sessions and len(self._sessions) >= self._max_sessions:
+            evicted_id = next(iter(self._sessions))
+            self.delete_session(evicted_id)
+            self.evictions += 1
+            logger.warning("Session limit reached, evicted session %s...", evicted_id[:8])
+        
+        session_id = _new_sid()
         
         if claim_context:
             text_prompt = format_claim_prompt(claim_context)
@@ -85,10 +170,21 @@ class SessionManager:
             session_id=session_id,
             claim_context=claim_context,
             text_prompt=text_prompt,
+            client_id=client_id,
+            context_key=context_key,
         )
         self._sessions[session_id] = session
-        logger.info(f"Created session {session_id[:8]}... with claim context: {claim_context is not None}")
-        return session_id
+        if context_key is not None:
+            self._by_context[context_key] = session_id
+        if client_id is not None:
+            self._client_counts[client_id] = self._client_counts.get(client_id, 0) + 1
+        heapq.heappush(self._expiry_heap, (session._expires_at, session_id))
+        logger.info(
+            "Created session %s... with claim context: %s",
+            session_id[:8],
+            claim_context is not None,
+        )
+        return session
     
     def get_session(self, session_id: str) -> Optional[Session]:
         """Get a session by ID, returning None if not found or expired."""
@@ -99,26 +195,77 @@ class SessionManager:
             self.delete_session(session_id)
             return None
         session.touch()
+        self._sessions.move_to_end(session_id)
         return session
     
+    def find_session(self, context_key: bytes) -> Optional[Session]:
+        """Get the live session created for a context digest, if any."""
+        session_id = self._by_context.get(context_key)
+        if session_id is None:
+            return None
+        return self.get_session(session_id)
+    
+    def client_session_count(self, client_id: str) -> int:
+        """Number of live sessions created by a client."""
+        return self._client_counts.get(client_id, 0)
+    
     def delete_session(self, session_id: str) -> None:
         """Delete a session."""
-        if session_id in self._sessions:
-            del self._sessions[session_id]
-            logger.info(f"Deleted session {session_id[:8]}...")
+        session = self._sessions.pop(session_id, None)
+        if session is not None:
+            context_key = session.context_key
+            if context_key is not None and self._by_context.get(context_key) == session_id:
+                del self._by_context[context_key]
+            client_id = session.client_id
+            if client_id is not None:
+                remaining = self._client_counts[client_id] - 1
+                if remaining:
+                    self._client_counts[client_id] = remaining
+                else:
+                    del self._client_counts[client_id]
+            logger.info("Deleted session %s...", session_id[:8])
+            if len(self._expiry_heap) > 2 * len(self._sessions):
+                self._rebuild_expiry_heap()
+    
+    def _rebuild_expiry_heap(self) -> None:
+        """Drop stale heap entries left behind by deleted or evicted sessions."""
+        # Rebuild in place; _pop_expired holds a reference to the list
+        self._expiry_heap[:] = [
+            (session._expires_at, sid) for sid, session in self._sessions.items()
+        ]
+        heapq.heapify(self._expiry_heap)
+    
+    def _pop_expired(self) -> int:
+        """Delete sessions whose deadline has passed, returning the count."""
+        heap = self._expiry_heap
+        now = time.monotonic()
+        removed = 0
+        while heap and heap[0][0] <= now:
+            _, sid = heapq.heappop(heap)
+            session = self._sessions.get(sid)
+            if session is None:
+                continue
+            if session._expires_at <= now:
+                self.delete_session(sid)
+                removed += 1
+            else:
+                # Touched since this entry was pushed; requeue at the new deadline
+                heapq.heappush(heap, (session._expires_at, sid))
+        return removed
     
     async def cleanup_expired(self) -> None:
-        """Periodically clean up expired sessions."""
+        """Clean up expired sessions as their deadlines come due."""
         while True:
-            await asyncio.sleep(300)  # Run every 5 minutes
-            expired = [
-                sid for sid, session in self._sessions.items()
-                if session.is_expired()
-            ]
-            for sid in expired:
-                self.delete_session(sid)
-            if expired:
-                logger.info(f"Cleaned up {len(expired)} expired sessions")
+            # New sessions never expire sooner than the TTL, so sleeping until
+            # the earliest queued deadline cannot miss one
+            if self._expiry_heap:
+                delay = self._expiry_heap[0][0] - time.monotonic()
+            else:
+                delay = _TTL_SECONDS
+            await asyncio.sleep(max(delay, 1.0))
+            removed = self._pop_expired()
+            if removed:
+                logger.info("Cleaned up %d expired sessions", removed)
     
     def start_cleanup_task(self) -> None:
         """Start the background cleanup task."""
@@ -136,12 +283,100 @@ class SessionManager:
 session_manager = SessionManager()
 
 # PersonaPlex process reference
-personaplex_process: Optional[subprocess.Popen] = None
+personaplex_process: Optional[asyncio.subprocess.Process] = None
+_personaplex_drain_tasks: list[asyncio.Task] = []
+_personaplex_ready_task: Optional[asyncio.Task] = None
+# Flipped by _watch_exit, so /health doesn't have to query the process
+_personaplex_alive = False
+# Set by _await_ready once PersonaPlex reports it is accepting connections
+_personaplex_ready = False
+
+# Log lines PersonaPlex (moshi/aiohttp) emits once it is accepting connections
+_READY_PATTERN = re.compile(r"Access the Web UI|Running on")
+_STREAM_LIMIT = 1 << 20
+
+
+async def _drain(
+    stream: asyncio.StreamReader,
+    log,
+    ready: asyncio.Event,
+    tail: Optional[deque] = None,
+) -> None:
+    """Relay subprocess output to the log so its pipe never fills up."""
+    while True:
+        try:
+            line = await stream.readline()
+        except ValueError:
+            # Overlong line (e.g. progress bar redraws); the reader discards it
+            continue
+        if not line:
+            return
+        text = line.decode(errors="replace").rstrip()
+        if tail is not None:
+            tail.append(text)
+        log("PersonaPlex: %s", text)
+        if not ready.is_set() and _READY_PATTERN.search(text):
+            ready.set()
+
+
+async def _watch_exit(process: asyncio.subprocess.Process) -> None:
+    """Mark PersonaPlex as down as soon as the process exits."""
+    global _personaplex_alive, _personaplex_ready
+    
+    returncode = await process.wait()
+    # stop_personaplex clears the flag first, so only unexpected exits log here
+    if _personaplex_alive:
+        _personaplex_alive = False
+        _personaplex_ready = False
+        logger.warning("PersonaPlex server exited with code %s", returncode)
+
+
+async def _await_ready(
+    process: asyncio.subprocess.Process,
+    ready: asyncio.Event,
+    stderr_tail: deque,
+) -> None:
+    """Flip the readiness flag once PersonaPlex reports it is serving."""
+    global _personaplex_ready
+    
+    ready_wait = asyncio.create_task(ready.wait())
+    exit_wait = asyncio.create_task(process.wait())
+    timeout: Optional[float] = PERSONAPLEX_STARTUP_TIMEOUT
+    try:
+        while True:
+            done, _ = await asyncio.wait(
+                {ready_wait, exit_wait},
+                timeout=timeout,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            if done:
+                break
+            logger.warning(
+                "PersonaPlex not ready after %ds; still waiting",
+                PERSONAPLEX_STARTUP_TIMEOUT,
+            )
+            timeout = None
+    finally:
+        ready_wait.cancel()
+        exit_wait.cancel()
+    
+    if ready.is_set() and process.returncode is None:
+        _personaplex_ready = True
+        logger.info("PersonaPlex server started on port %d", PERSONAPLEX_PORT)
+    else:
+        logger.error("PersonaPlex server failed to start: %s", "\n".join(stderr_tail))
 
 
 async def start_personaplex():
-    """Start the PersonaPlex server as a subprocess."""
-    global personaplex_process
+    """
+    Start the PersonaPlex server as a subprocess.
+    
+    Returns once the process is spawned; readiness is tracked in the
+    background so the API (and /health) can serve while the model loads.
+    """
+    import sys
+    
+    global personaplex_process, _personaplex_alive, _personaplex_ready_task
     
     ssl_dir = os.getenv("SSL_DIR", "/tmp/personaplex-ssl")
     os.makedirs(ssl_dir, exist_ok=True)
@@ -156,35 +391,57 @@ async def start_personaplex():
     if os.getenv("CPU_OFFLOAD", "").lower() == "true":
         cmd.append("--cpu-offload")
     
-    logger.info(f"Starting PersonaPlex server: {' '.join(cmd)}")
-    
-    personaplex_process = subprocess.Popen(
-        cmd,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        env={**os.environ, "HF_TOKEN": os.getenv("HF_TOKEN", "")},
+    logger.info("Starting PersonaPlex server: %s", " ".join(cmd))
+    
+    personaplex_process = await asyncio.create_subprocess_exec(
+        *cmd,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        env={
+            **os.environ,
+            "HF_TOKEN": os.getenv("HF_TOKEN", ""),
+            # The ready lines are print()ed; don't let them sit in a pipe buffer
+            "PYTHONUNBUFFERED": "1",
+        },
+        limit=_STREAM_LIMIT,
+    )
+    _personaplex_alive = True
+    
+    ready = asyncio.Event()
+    stderr_tail: deque = deque(maxlen=50)
+    _personaplex_drain_tasks[:] = [
+        asyncio.create_task(_drain(personaplex_process.stdout, logger.info, ready)),
+        asyncio.create_task(_drain(personaplex_process.stderr, logger.warning, ready, stderr_tail)),
+        asyncio.create_task(_watch_exit(personaplex_process)),
+    ]
+    _personaplex_ready_task = asyncio.create_task(
+        _await_ready(personaplex_process, ready, stderr_tail)
     )
-    
-    # Wait a bit for the server to start
-    await asyncio.sleep(10)
-    
-    if personaplex_process.poll() is not None:
-        stderr = personaplex_process.stderr.read().decode() if personaplex_process.stderr else ""
-        raise RuntimeError(f"PersonaPlex server failed to start: {stderr}")
-    
-    logger.info(f"PersonaPlex server started on port {PERSONAPLEX_PORT}")
 
 
 async def stop_personaplex():
     """Stop the PersonaPlex server."""
-    global personaplex_process
+    global personaplex_process, _personaplex_alive, _personaplex_ready, _personaplex_ready_task
     
     if personaplex_process:
-        personaplex_process.terminate()
-        try:
-            personaplex_process.wait(timeout=10)
-        except subprocess.TimeoutExpired:
-            personaplex_process.kill()
+        _personaplex_alive = False
+        _personaplex_ready = False
+        if _personaplex_ready_task is not None:
+            _personaplex_ready_task.cancel()
+            _personaplex_ready_task = None
+        # Keep draining output until the child exits so it can't block on a full pipe
+        if personaplex_process.returncode is None:
+            personaplex_process.terminate()
+            try:
+                await asyncio.wait_for(personaplex_process.wait(), timeout=10)
+            except asyncio.TimeoutError:
+                personaplex_process.kill()
+                await personaplex_process.wait()
+        if _personaplex_drain_tasks:
+            _, pending = await asyncio.wait(_personaplex_drain_tasks, timeout=5)
+            for task in pending:
+                task.cancel()
+        _personaplex_drain_tasks.clear()
         personaplex_process = None
         logger.info("PersonaPlex server stopped")
 
@@ -200,7 +457,7 @@ async def lifespan(app: FastAPI):
         try:
             await start_personaplex()
         except Exception as e:
-            logger.error(f"Failed to start PersonaPlex: {e}")
+            logger.error("Failed to start PersonaPlex: %s", e)
             # Continue anyway for development
     
     yield
@@ -231,11 +488,15 @@ app.add_middleware(
 # Request/Response models
 class CreateSessionRequest(BaseModel):
     """Request to create a new voice session."""
+    model_config = ConfigDict(frozen=True)
+
     claim_context: Optional[dict] = None
 
 
 class CreateSessionResponse(BaseModel):
     """Response with session details."""
+    model_config = ConfigDict(frozen=True)
+
     session_id: str
     websocket_url: str
     text_prompt: str
@@ -243,6 +504,8 @@ class CreateSessionResponse(BaseModel):
 
 class SessionInfoResponse(BaseModel):
     """Session information response."""
+    model_config = ConfigDict(frozen=True)
+
     session_id: str
     has_claim_context: bool
     text_prompt: str
@@ -250,19 +513,33 @@ class SessionInfoResponse(BaseModel):
     last_accessed: str
 
 
+def _client_id(request: Request) -> str:
+    """Identify the calling client by its address."""
+    # X-Forwarded-For is caller-controlled, so it is not read here. uvicorn's
+    # proxy headers support rewrites request.client from it, taking the
+    # rightmost untrusted hop, only for peers in FORWARDED_ALLOW_IPS.
+    return request.client.host if request.client else "unknown"
+
+
 # API endpoints
 @app.get("/health")
 async def health_check():
     """Health check endpoint."""
     return {
         "status": "healthy",
-        "personaplex_running": personaplex_process is not None and personaplex_process.poll() is None,
+        "personaplex_running": _personaplex_alive,
+        "personaplex_ready": _personaplex_ready,
         "active_sessions": len(session_manager._sessions),
+        "evicted_sessions": session_manager.evictions,
     }
 
 
 @app.post("/sessions", response_model=CreateSessionResponse)
-async def create_session(request: CreateSessionRequest):
+async def create_session(
+    request: CreateSessionRequest,
+    raw_request: Request,
+    reuse: bool = False,
+):
     """
     Create a new voice session with optional claim context.
     
@@ -277,19 +554,32 @@ async def create_session(request: CreateSessionRequest):
     - status: string
     - diagnoses: list of strings
     - procedures: list of strings
-    """
-    session_id = session_manager.create_session(request.claim_context)
-    session = session_manager.get_session(session_id)
     
-    # Build WebSocket URL for PersonaPlex
-    # The client will connect through the wrapper's WebSocket proxy
-    host = os.getenv("PUBLIC_HOST", "localhost")
-    ws_url = f"ws://{host}:{CONTEXT_API_PORT}"
+    With reuse=true, a repeat reuse request from the same client address with
+    the same claim_context returns the existing session. It is opt-in because
+    callers behind one address (tabs, office NAT) can't be told apart, and
+    deleting a shared session would end it for all of them.
+    """
+    client_id = _client_id(raw_request)
+    context_key = None
+    session = None
+    if reuse:
+        context_key = _context_key(request.claim_context, client_id)
+        session = session_manager.find_session(context_key)
+    
+    if session is None:
+        if session_manager.client_session_count(client_id) >= MAX_SESSIONS_PER_CLIENT:
+            raise HTTPException(status_code=429, detail="Too many active sessions for this client")
+        session = session_manager.create_session(
+            request.claim_context,
+            client_id=client_id,
+            context_key=context_key,
+        )
     
     return CreateSessionResponse(
-        session_id=session_id,
-        websocket_url=ws_url,
-        text_prompt=session.text_prompt if session else DEFAULT_ASSISTANT_PROMPT,
+        session_id=session.session_id,
+        websocket_url=_WS_BASE_URL,
+        text_prompt=session.text_prompt,
     )
 
 
@@ -328,74 +618,107 @@ async def websocket_proxy(websocket: WebSocket, session_id: str):
     This endpoint acts as a bridge between the client and PersonaPlex,
     allowing us to inject the text prompt based on the session's claim context.
     """
-    import websockets
-    
     session = session_manager.get_session(session_id)
     if not session:
         await websocket.close(code=4001, reason="Session not found or expired")
         return
     
+    sid8 = session_id[:8]
     await websocket.accept()
-    logger.info(f"Client connected to session {session_id[:8]}...")
+    logger.info("Client connected to session %s...", sid8)
     
     # Connect to PersonaPlex
-    # PersonaPlex WebSocket endpoint is at /api/chat with voice_prompt and text_prompt query params
-    host = os.getenv("PERSONAPLEX_HOST", "localhost")
-    query_params = urlencode({
-        "voice_prompt": VOICE_PROMPT,
-        "text_prompt": session.text_prompt,
-    })
-    personaplex_url = f"ws://{host}:{PERSONAPLEX_PORT}/api/chat?{query_params}"
-    logger.info(f"Connecting to PersonaPlex at ws://{host}:{PERSONAPLEX_PORT}/api/chat")
+    logger.info("Connecting to PersonaPlex at %s", _PP_BASE_URL)
     
     try:
+        # Upstream sockets can't be pooled: PersonaPlex takes the text prompt in
+        # the handshake URL and runs one conversation per connection. Skip
+        # permessage-deflate negotiation; Opus audio frames don't compress.
         async with websockets.connect(
-            personaplex_url,
+            session.personaplex_url,
+            compression=None,
         ) as pp_ws:
-            logger.info(f"Connected to PersonaPlex for session {session_id[:8]}...")
+            logger.info("Connected to PersonaPlex for session %s...", sid8)
             
             async def forward_to_personaplex():
                 """Forward messages from client to PersonaPlex."""
-                try:
-                    while True:
-                        data = await websocket.receive()
-                        if "bytes" in data:
-                            await pp_ws.send(data["bytes"])
-                        elif "text" in data:
-                            await pp_ws.send(data["text"])
-                except WebSocketDisconnect:
-                    pass
+                receive = websocket.receive
+                send = pp_ws.send
+                while True:
+                    data = await receive()
+                    # Audio frames dominate, so check bytes first with one lookup
+                    payload = data.get("bytes")
+                    if payload is None:
+                        payload = data.get("text")
+                    if payload is not None:
+                        await send(payload)
+                    elif data["type"] == "websocket.disconnect":
+                        # Starlette hands back the raw ASGI message rather than raising
+                        return
             
             async def forward_to_client():
                 """Forward messages from PersonaPlex to client."""
+                send_bytes = websocket.send_bytes
+                send_text = websocket.send_text
                 try:
                     async for message in pp_ws:
                         if isinstance(message, bytes):
-                            await websocket.send_bytes(message)
+                            await send_bytes(message)
                         else:
-                            await websocket.send_text(message)
+                            await send_text(message)
                 except websockets.exceptions.ConnectionClosed:
                     pass
             
-            # Run both forwarding tasks concurrently
-            await asyncio.gather(
-                forward_to_personaplex(),
-                forward_to_client(),
-                return_exceptions=True,
+            # Run both forwarding tasks concurrently; when either side closes,
+            # cancel the other so it doesn't linger on a dead peer
+            done, pending = await asyncio.wait(
+                {
+                    asyncio.create_task(forward_to_personaplex()),
+                    asyncio.create_task(forward_to_client()),
+                },
+                return_when=asyncio.FIRST_COMPLETED,
             )
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+            for task in done:
+                # Retrieve errors so they aren't reported as never retrieved
+                task.exception()
+            
+            # If PersonaPlex hung up first, close the client explicitly rather
+            # than leaving it to see an abnormal (1006) closure
+            if websocket.client_state is WebSocketState.CONNECTED:
+                code = pp_ws.close_code
+                reason = pp_ws.close_reason or ""
+                if code == 1005:
+                    code = 1000
+                elif code is None or code in _ABNORMAL_CLOSE_CODES:
+                    logger.warning(
+                        "PersonaPlex closed abnormally for session %s... (code %s)",
+                        sid8,
+                        code,
+                    )
+                    code = 1011
+                    reason = reason or "PersonaPlex connection lost"
+                await websocket.close(code=code, reason=reason)
     
     except Exception as e:
-        logger.error(f"WebSocket proxy error: {e}")
+        logger.error("WebSocket proxy error: %s", e)
         await websocket.close(code=4002, reason=str(e))
     
     finally:
-        logger.info(f"Client disconnected from session {session_id[:8]}...")
+        logger.info("Client disconnected from session %s...", sid8)
 
 
 if __name__ == "__main__":
+    import uvicorn
+    
     uvicorn.run(
         "server:app",
         host="0.0.0.0",
         port=CONTEXT_API_PORT,
         reload=os.getenv("NODE_ENV") != "production",
+        # Loop and ws stay on "auto": uvloop where installed (not on Windows),
+        # and uvicorn's current websockets implementation
+        http="httptools",
     )